@@ -3,15 +3,22 @@ import asyncio
 import json
 import os
 import traceback
-import inspect
-import random
-import string
+import sys
 import threading
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import Any, Optional, Set
+from queue import Empty, SimpleQueue
+from typing import Any, List, Optional, Tuple, Union
+import orjson
+from websockets.frames import Frame, Opcode
 from websockets.server import serve, WebSocketServerProtocol
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 
 class LogLevel(Enum):
     DEBUG = 'DEBUG'
@@ -31,11 +38,46 @@ CI_ENV_VARS = [
     'TRAVIS'
 ]
 
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_LEVEL_ORD = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+# Maps every byte value onto [a-z0-9] so random bytes become an id in one translate()
+_ID_TABLE = bytes(b'abcdefghijklmnopqrstuvwxyz0123456789'[i % 36] for i in range(256))
+# How long the worker keeps collecting records into one WebSocket frame
+_BATCH_INTERVAL = 0.01
+# Caps on one frame so a backlog goes out over several ticks instead of one huge array
+_BATCH_MAX_ENTRIES = 500
+_BATCH_MAX_BYTES = 256 * 1024
+# Clients with this many broadcasts waiting to be written are dropped. With capped
+# batches this bounds a slow client to roughly _CLIENT_QUEUE_SIZE * _BATCH_MAX_BYTES.
+_CLIENT_QUEUE_SIZE = 256
+
 
 def _detect_ci() -> bool:
     return any(os.environ.get(var) for var in CI_ENV_VARS)
 
 
+def _format_stack(frames: list) -> str:
+    """Render a stack snapshot from the caller's frame onwards."""
+    return '\n'.join(f'  at {func} ({file}:{line})' for file, line, func in frames)
+
+
+def _json_default(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat().replace('+00:00', 'Z')
+    return str(value)
+
+
+def _dumps(entry: Any) -> bytes:
+    """Serialize a log entry, emitting datetimes as RFC 3339 with a Z suffix."""
+    try:
+        return orjson.dumps(entry, default=str, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+    except orjson.JSONEncodeError:
+        # orjson rejects ints beyond 64 bits without consulting default; stdlib json doesn't
+        return json.dumps(
+            entry, default=_json_default, ensure_ascii=False, separators=(',', ':')
+        ).encode()
+
+
 class CIWriter:
     """Write log entries to a file in NDJSON format with a rolling window."""
 
@@ -73,7 +115,7 @@ class CIWriter:
                 return
 
             try:
-                line = json.dumps(entry, default=str)
+                line = _dumps(entry).decode()
             except Exception:
                 return
 
@@ -134,12 +176,20 @@ class CIWriter:
 
 class SlogX:
     def __init__(self):
-        self._clients: Set[WebSocketServerProtocol] = set()
+        # Each client is paired with the queue its writer task drains
+        # Only the event loop touches this, so a plain list is safe to iterate
+        self._clients: List[Tuple[WebSocketServerProtocol, asyncio.Queue]] = []
         self._service_name: str = 'python-service'
         self._server = None
         self._loop: Optional[asyncio.AbstractEventLoop] = None
         self._ci_writer: Optional[CIWriter] = None
         self._initialized: bool = False
+        # Mirrors bool(self._clients) (or CI mode) so _log can bail out with one read
+        self._has_clients: bool = False
+        self._queue: SimpleQueue = SimpleQueue()
+        self._worker: Optional[threading.Thread] = None
+        self._min_level_ord: int = _LEVEL_ORD['DEBUG']
+        self._always_capture_stack: bool = False
 
     def init(
         self,
@@ -148,7 +198,9 @@ class SlogX:
         service_name: str = 'python-service',
         ci_mode: Optional[bool] = None,
         log_file_path: Optional[str] = None,
-        max_entries: int = 10000
+        max_entries: int = 10000,
+        min_level: Union[str, LogLevel] = 'DEBUG',
+        always_capture_stack: bool = False
     ):
         """Initialize the SlogX server. Starts a WebSocket server on the specified port.
 
@@ -159,34 +211,50 @@ class SlogX:
             ci_mode: Optional. None = auto-detect, True = force CI mode, False = force WebSocket mode
             log_file_path: Optional. Log file path for CI mode
             max_entries: Optional. Max log entries to keep for CI mode
+            min_level: Optional. Drop entries below this level ('DEBUG', 'INFO', 'WARN', 'ERROR' or a LogLevel)
+            always_capture_stack: Optional. Attach the call-site stack to entries without an exception
 
         Blocks until the server is ready to accept connections.
         """
         if not is_dev:
             return
 
+        min_level = getattr(min_level, 'value', min_level)
+        if min_level not in _LEVEL_ORD:
+            raise ValueError(f"min_level must be one of {', '.join(_LEVEL_ORD)}, got {min_level!r}")
+
+        self._min_level_ord = _LEVEL_ORD[min_level]
+        self._always_capture_stack = always_capture_stack
         self._service_name = service_name
         use_ci = ci_mode if ci_mode is not None else _detect_ci()
 
         if use_ci:
             file_path = log_file_path or f"./slogx_logs/{self._service_name}.ndjson"
             self._ci_writer = CIWriter(file_path, max_entries)
+            self._has_clients = True
             self._initialized = True
             print(f"[slogx] 📝 CI mode: logging to {file_path}")
             return
 
-        self._loop = asyncio.new_event_loop()
+        # uvloop is optional; only our private loop uses it, the global policy is left alone
+        self._loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
         ready_event = threading.Event()
 
         async def handler(websocket: WebSocketServerProtocol):
-            self._clients.add(websocket)
+            client = (websocket, asyncio.Queue(maxsize=_CLIENT_QUEUE_SIZE))
+            writer = asyncio.ensure_future(self._write_frames(*client))
+            self._clients.append(client)
+            self._has_clients = True
             try:
                 await websocket.wait_closed()
             finally:
-                self._clients.discard(websocket)
+                writer.cancel()
+                self._remove_client(client)
 
         async def start_server():
-            self._server = await serve(handler, "localhost", port)
+            # Broadcast frames are written pre-built and uncompressed, so
+            # per-connection permessage-deflate would only cost memory
+            self._server = await serve(handler, "localhost", port, compression=None)
             print(f"[slogx] 🚀 Log server running at ws://localhost:{port}")
             ready_event.set()
             await self._server.wait_closed()
@@ -198,132 +266,231 @@ class SlogX:
         thread = threading.Thread(target=run_loop, daemon=True)
         thread.start()
         ready_event.wait()  # Block until server is ready
+
+        # Start from an empty queue so records that raced a previous close() aren't sent
+        self._queue = SimpleQueue()
+        self._worker = threading.Thread(target=self._drain_queue, daemon=True)
+        self._worker.start()
         self._initialized = True
 
     def _generate_id(self) -> str:
-        return ''.join(random.choices(string.ascii_lowercase + string.digits, k=13))
-
-    def _get_caller_info(self) -> dict:
-        """Extract caller information from the stack trace."""
-        stack = inspect.stack()
-        this_file = __file__
-
-        for i, frame_info in enumerate(stack):
-            if frame_info.filename != this_file:
-                file = frame_info.filename.split('/')[-1]
-                line = frame_info.lineno
-                func = frame_info.function
-                # Build stack trace from caller's frame onwards
-                frames = stack[i:]
-                clean_stack = '\n'.join(
-                    f'  at {f.function} ({f.filename}:{f.lineno})'
-                    for f in frames
-                )
-                return {'file': file, 'line': line, 'func': func, 'clean_stack': clean_stack}
-
-        return {'file': None, 'line': None, 'func': None, 'clean_stack': None}
-
-    def _log(self, level: LogLevel, *args: Any):
-        """Core logging function."""
-        if self._ci_writer:
-            caller = self._get_caller_info()
-            processed_args = []
-            final_stack = caller.get('clean_stack')
-
-            for arg in args:
-                if isinstance(arg, Exception):
-                    final_stack = ''.join(traceback.format_exception(type(arg), arg, arg.__traceback__))
-                    processed_args.append({
-                        'name': type(arg).__name__,
-                        'message': str(arg),
-                        'stack': final_stack
-                    })
-                else:
-                    processed_args.append(arg)
-
-            entry = {
-                'id': self._generate_id(),
-                'timestamp': datetime.utcnow().isoformat() + 'Z',
-                'level': level.value,
-                'args': processed_args,
-                'stacktrace': final_stack,
-                'metadata': {
-                    'file': caller.get('file'),
-                    'line': caller.get('line'),
-                    'func': caller.get('func'),
-                    'lang': 'python',
-                    'service': self._service_name
-                }
-            }
-
-            self._ci_writer.write(entry)
-            return
+        return os.urandom(13).translate(_ID_TABLE).decode()
 
-        if not self._loop or not self._clients:
-            return
+    def _capture_stack(self, want_stack: bool = True) -> list:
+        """Snapshot (file, line, func) for each frame from the caller outwards.
 
-        caller = self._get_caller_info()
+        With want_stack=False only the caller's own frame is recorded.
+        """
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_code.co_filename == __file__:
+            frame = frame.f_back
+
+        if not want_stack:
+            return [] if frame is None else [(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)]
+
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append((code.co_filename, frame.f_lineno, code.co_name))
+            frame = frame.f_back
+        return frames
+
+    def _prepare_args(self, args: tuple) -> Tuple[list, Optional[str]]:
+        """Convert Exception args to plain dicts; returns (args, last exception's traceback)."""
         processed_args = []
-        final_stack = caller.get('clean_stack')
+        exc_stack = None
 
         for arg in args:
             if isinstance(arg, Exception):
-                final_stack = ''.join(traceback.format_exception(type(arg), arg, arg.__traceback__))
+                exc_stack = ''.join(traceback.format_exception(type(arg), arg, arg.__traceback__))
                 processed_args.append({
                     'name': type(arg).__name__,
                     'message': str(arg),
-                    'stack': final_stack
+                    'stack': exc_stack
                 })
             else:
                 processed_args.append(arg)
 
-        entry = {
+        return processed_args, exc_stack
+
+    def _build_entry(
+        self,
+        level: str,
+        frames: list,
+        args: Any,
+        exc_stack: Optional[str],
+        ts_ns: int,
+        want_stack: bool = True
+    ) -> dict:
+        """Turn a log record with prepared args into a serializable entry."""
+        svc = self._service_name
+        if frames:
+            file, line, func = frames[0]
+            file = file.rsplit('/', 1)[-1]
+        else:
+            file = line = func = None
+
+        final_stack = exc_stack
+        # An exception's traceback wins, so only render the call-site stack without one
+        if want_stack and final_stack is None and frames:
+            final_stack = _format_stack(frames)
+
+        # Every entry has this exact shape. A dict literal is the cheapest record orjson
+        # can encode; a slotted dataclass measured about 2x slower to build and dump.
+        return {
             'id': self._generate_id(),
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
-            'level': level.value,
-            'args': processed_args,
+            'timestamp': _EPOCH + timedelta(microseconds=ts_ns // 1000),
+            'level': level,
+            'args': args,
             'stacktrace': final_stack,
-            'metadata': {
-                'file': caller.get('file'),
-                'line': caller.get('line'),
-                'func': caller.get('func'),
-                'lang': 'python',
-                'service': self._service_name
-            }
+            'metadata': {'file': file, 'line': line, 'func': func, 'lang': 'python', 'service': svc}
         }
 
-        payload = json.dumps(entry, default=str)
-
-        async def broadcast():
-            for client in list(self._clients):
+    def _drain_queue(self):
+        """Worker loop: batch queued records into one JSON array per broadcast."""
+        # Bound once: none of these change while the worker runs
+        queue = self._queue
+        loop = self._loop
+        build_entry = self._build_entry
+        broadcast = self._broadcast
+        monotonic = time.monotonic
+
+        def send(encoded: list):
+            if loop.is_running():
+                loop.call_soon_threadsafe(broadcast, b'[' + b','.join(encoded) + b']')
+
+        while True:
+            batch = [queue.get()]
+            deadline = monotonic() + _BATCH_INTERVAL
+            while batch[-1] is not None and len(batch) < _BATCH_MAX_ENTRIES:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
                 try:
-                    await client.send(payload)
+                    batch.append(queue.get(timeout=remaining))
+                except Empty:
+                    break
+
+            encoded = []
+            size = 0
+            for item in batch:
+                if item is None:
+                    continue
+                try:
+                    data = _dumps(build_entry(*item))
                 except Exception:
-                    self._clients.discard(client)
+                    continue
+                if encoded and size + len(data) > _BATCH_MAX_BYTES:
+                    send(encoded)
+                    encoded = []
+                    size = 0
+                encoded.append(data)
+                size += len(data) + 1
+
+            if encoded:
+                send(encoded)
+
+            if batch[-1] is None:
+                return
 
-        if self._loop and self._loop.is_running():
-            asyncio.run_coroutine_threadsafe(broadcast(), self._loop)
+    def _remove_client(self, client: Tuple[WebSocketServerProtocol, asyncio.Queue]):
+        if client in self._clients:
+            self._clients.remove(client)
+        # Only ever lower the flag: sockets still closing after close() must not turn logging back on
+        if not self._clients:
+            self._has_clients = False
+
+    def _broadcast(self, payload: bytes):
+        """Frame the payload once and queue the same bytes for every client."""
+        # orjson output is valid UTF-8, so it can go out as a text frame as-is
+        framed = Frame(Opcode.TEXT, payload).serialize(mask=False)
+        slow = []
+        for client in self._clients:
+            try:
+                client[1].put_nowait(framed)
+            except asyncio.QueueFull:
+                slow.append(client)
+
+        # Slow consumers are dropped rather than buffered without bound. The flag is
+        # only ever lowered here so a broadcast racing close() can't re-enable logging.
+        if slow:
+            for client in slow:
+                self._clients.remove(client)
+                client[0].transport.abort()
+            self._has_clients = bool(self._clients)
+
+    async def _write_frames(self, websocket: WebSocketServerProtocol, queue: asyncio.Queue):
+        """Per-client writer: push queued frames to the transport, honouring flow control."""
+        try:
+            while True:
+                framed = await queue.get()
+                if not websocket.open:
+                    return
+                websocket.transport.write(framed)
+                await websocket.drain()
+        except Exception:
+            return
+
+    def _log(self, level: str, *args: Any):
+        """Core logging function.
+
+        Args are snapshotted on the caller's thread, so mutating a logged object afterwards
+        doesn't change what is sent. Ids, timestamps and stack formatting are left to the worker.
+        """
+        if not self._has_clients:
+            return
+
+        ts_ns = time.time_ns()
+        args, exc_stack = self._prepare_args(args)
+        # The call-site stack is opt-in, and an exception's traceback replaces it anyway,
+        # so usually only the caller frame is needed for file/line/func
+        want_stack = self._always_capture_stack and exc_stack is None
+        frames = self._capture_stack(want_stack)
+        # Read once so a concurrent close() can't clear it between the check and the write
+        ci_writer = self._ci_writer
+        if ci_writer:
+            ci_writer.write(self._build_entry(level, frames, args, exc_stack, ts_ns, want_stack))
+            return
+
+        try:
+            snapshot = orjson.Fragment(_dumps(args))
+        except Exception:
+            return
+        self._queue.put((level, frames, snapshot, exc_stack, ts_ns, want_stack))
 
     def close(self):
         if self._ci_writer:
             self._ci_writer.close()
             self._ci_writer = None
+        self._has_clients = False
+        if self._worker:
+            self._queue.put(None)
+            self._worker.join(timeout=1)
+            self._worker = None
         if self._server:
             self._server.close()
             self._server = None
         self._initialized = False
 
     def debug(self, *args: Any):
-        self._log(LogLevel.DEBUG, *args)
+        if _LEVEL_ORD['DEBUG'] < self._min_level_ord:
+            return
+        self._log('DEBUG', *args)
 
     def info(self, *args: Any):
-        self._log(LogLevel.INFO, *args)
+        if _LEVEL_ORD['INFO'] < self._min_level_ord:
+            return
+        self._log('INFO', *args)
 
     def warn(self, *args: Any):
-        self._log(LogLevel.WARN, *args)
+        if _LEVEL_ORD['WARN'] < self._min_level_ord:
+            return
+        self._log('WARN', *args)
 
     def error(self, *args: Any):
-        self._log(LogLevel.ERROR, *args)
+        if _LEVEL_ORD['ERROR'] < self._min_level_ord:
+            return
+        self._log('ERROR', *args)
 
 
 slogx = SlogX()
@@ -1,12 +1,17 @@
 """Unit tests for the slogx Python SDK."""
 
+import asyncio
 import os
 import pytest
 import json
 import tempfile
+import threading
+import time
 from datetime import datetime
 from unittest.mock import MagicMock, patch
-from slogx import SlogX, LogLevel, _detect_ci, CI_ENV_VARS
+from slogx import (
+    SlogX, LogLevel, _detect_ci, _dumps, _BATCH_MAX_BYTES, _BATCH_MAX_ENTRIES, CI_ENV_VARS
+)
 
 
 class TestLogLevel:
@@ -29,9 +34,17 @@ class TestSlogXInitialization:
     def test_default_initialization(self):
         s = SlogX()
         assert s._service_name == 'python-service'
-        assert s._clients == set()
+        assert s._clients == []
         assert s._server is None
         assert s._loop is None
+        assert s._has_clients is False
+
+    def test_log_without_clients_is_noop(self):
+        s = SlogX()
+        with patch.object(s, '_capture_stack') as capture:
+            s.info('nobody listening')
+        capture.assert_not_called()
+        assert s._queue.empty()
 
 
 class TestIDGeneration:
@@ -59,43 +72,47 @@ class TestIDGeneration:
 class TestCallerInfo:
     """Tests for caller info extraction."""
 
-    def test_get_caller_info_returns_dict(self):
+    def test_capture_stack_returns_frame_tuples(self):
         s = SlogX()
-        info = s._get_caller_info()
-        assert isinstance(info, dict)
-        assert 'file' in info
-        assert 'line' in info
-        assert 'func' in info
-        assert 'clean_stack' in info
+        frames = s._capture_stack()
+        assert isinstance(frames, list)
+        assert all(len(frame) == 3 for frame in frames)
 
-    def test_get_caller_info_file(self):
+    def test_capture_stack_file(self):
         s = SlogX()
-        info = s._get_caller_info()
+        entry = s._build_entry('INFO', s._capture_stack(), *s._prepare_args(()), 0)
         # Should get this test file
-        assert info['file'] == 'test_slogx.py'
+        assert entry['metadata']['file'] == 'test_slogx.py'
 
-    def test_get_caller_info_line_number(self):
+    def test_capture_stack_line_number(self):
         s = SlogX()
         line_before = self._get_line_number()
-        info = s._get_caller_info()
-        # Line should be close to where we called it
-        assert isinstance(info['line'], int)
-        assert info['line'] > 0
+        frames = s._capture_stack()
+        # Line should be just after the one we recorded
+        assert frames[0][1] == line_before + 1
 
     def _get_line_number(self):
         import inspect
-        return inspect.currentframe().f_lineno
+        return inspect.currentframe().f_back.f_lineno
+
+    def test_capture_stack_function_name(self):
+        s = SlogX()
+        frames = s._capture_stack()
+        assert frames[0][2] == 'test_capture_stack_function_name'
 
-    def test_get_caller_info_function_name(self):
+    def test_capture_stack_stack_trace(self):
         s = SlogX()
-        info = s._get_caller_info()
-        assert info['func'] == 'test_get_caller_info_function_name'
+        entry = s._build_entry('INFO', s._capture_stack(), *s._prepare_args(()), 0)
+        assert entry['stacktrace'] is not None
+        assert 'test_slogx.py' in entry['stacktrace']
 
-    def test_get_caller_info_stack_trace(self):
+    def test_capture_stack_caller_frame_only(self):
         s = SlogX()
-        info = s._get_caller_info()
-        assert info['clean_stack'] is not None
-        assert 'test_slogx.py' in info['clean_stack']
+        frames = s._capture_stack(want_stack=False)
+        assert len(frames) == 1
+        assert frames[0][0].endswith('test_slogx.py')
+        assert frames[0][2] == 'test_capture_stack_caller_frame_only'
+        assert len(s._capture_stack()) > 1
 
 
 class TestExceptionHandling:
@@ -143,27 +160,239 @@ class TestExceptionHandling:
             assert serialized['message'] == 'Custom message'
 
 
+class TestBroadcast:
+    """Tests for fan-out to connected clients."""
+
+    class FakeTransport:
+        def __init__(self):
+            self.written = []
+            self.aborted = False
+
+        def write(self, data):
+            self.written.append(data)
+
+        def abort(self):
+            self.aborted = True
+
+    class FakeWebSocket:
+        def __init__(self):
+            self.open = True
+            self.transport = TestBroadcast.FakeTransport()
+
+        async def drain(self):
+            pass
+
+    def _client(self, maxsize=8):
+        return (self.FakeWebSocket(), asyncio.Queue(maxsize=maxsize))
+
+    def test_broadcast_queues_same_frame_for_all_clients(self):
+        s = SlogX()
+        clients = [self._client() for _ in range(3)]
+        s._clients = list(clients)
+        s._has_clients = True
+
+        s._broadcast(b'[{"ok":true}]')
+
+        frames = [queue.get_nowait() for _, queue in clients]
+        assert frames[0] == frames[1] == frames[2]
+        # FIN + text opcode, unmasked, 13 byte payload
+        assert frames[0] == b'\x81\x0d[{"ok":true}]'
+        assert s._has_clients is True
+
+    def test_broadcast_drops_slow_clients(self):
+        s = SlogX()
+        good, slow = self._client(), self._client(maxsize=1)
+        s._clients = [good, slow]
+        s._has_clients = True
+
+        s._broadcast(b'[1]')
+        s._broadcast(b'[2]')
+
+        assert s._clients == [good]
+        assert slow[0].transport.aborted
+        assert good[1].qsize() == 2
+
+        s._clients = [slow]
+        s._broadcast(b'[3]')
+        assert s._has_clients is False
+
+    def test_broadcast_after_close_keeps_logging_off(self):
+        s = SlogX()
+        client = self._client()
+        s._clients = [client]
+        s._has_clients = False  # close() already ran, sockets still closing
+
+        s._broadcast(b'[]')
+
+        assert s._has_clients is False
+        assert client[1].qsize() == 1
+
+    def test_remove_client_only_lowers_flag(self):
+        s = SlogX()
+        first, second = self._client(), self._client()
+        s._clients = [first, second]
+        s._has_clients = False  # close() already ran, sockets still closing
+
+        s._remove_client(first)
+        assert s._clients == [second]
+        assert s._has_clients is False
+
+        s._has_clients = True
+        s._remove_client(second)
+        s._remove_client(second)  # Already dropped by _broadcast
+        assert s._clients == []
+        assert s._has_clients is False
+
+    def test_write_frames_writes_until_closed(self):
+        s = SlogX()
+        websocket, queue = self._client()
+
+        async def run():
+            queue.put_nowait(b'first')
+            queue.put_nowait(b'second')
+            writer = asyncio.ensure_future(s._write_frames(websocket, queue))
+            await asyncio.sleep(0)
+            websocket.open = False
+            queue.put_nowait(b'dropped')
+            await asyncio.wait_for(writer, 1)
+
+        asyncio.run(run())
+        assert websocket.transport.written == [b'first', b'second']
+
+
+class TestQueuedLogging:
+    """Tests for records queued for the WebSocket worker."""
+
+    def test_args_are_snapshotted_on_the_caller_thread(self):
+        s = SlogX()
+        s._has_clients = True
+        state = {'n': 1}
+
+        s.info('state', state)
+        state['n'] += 1
+
+        level, frames, args, exc_stack, ts_ns, want_stack = s._queue.get_nowait()
+        entry = json.loads(_dumps(s._build_entry(level, frames, args, exc_stack, ts_ns, want_stack)))
+        assert entry['args'] == ['state', {'n': 1}]
+        assert entry['metadata']['func'] == 'test_args_are_snapshotted_on_the_caller_thread'
+
+    def test_exception_traceback_is_prepared_on_the_caller_thread(self):
+        s = SlogX()
+        s._has_clients = True
+        try:
+            raise ValueError('boom')
+        except ValueError as e:
+            s.error('failed', e)
+
+        record = s._queue.get_nowait()
+        assert 'ValueError: boom' in record[3]
+
+
+class TestWorker:
+    """Tests for the background queue drain."""
+
+    class StubLoop:
+        def __init__(self):
+            self.calls = []
+
+        def is_running(self):
+            return True
+
+        def call_soon_threadsafe(self, callback, *args):
+            self.calls.append((callback, args))
+
+    def _record(self, *args):
+        return ('INFO', [('/app/main.py', 1, 'main')], list(args), None, 0, False)
+
+    def test_drain_queue_flushes_before_sentinel(self):
+        s = SlogX()
+        s._loop = self.StubLoop()
+        s._queue.put(self._record('first'))
+        s._queue.put(self._record('second'))
+        s._queue.put(None)
+
+        s._drain_queue()  # Returns on the sentinel instead of blocking
+
+        assert len(s._loop.calls) == 1
+        callback, (payload,) = s._loop.calls[0]
+        assert callback == s._broadcast
+        assert [e['args'] for e in json.loads(payload)] == [['first'], ['second']]
+
+    def test_drain_queue_sends_batch_as_json_array(self):
+        class Unprintable:
+            def __str__(self):
+                raise RuntimeError('no str')
+
+        s = SlogX()
+        s._loop = self.StubLoop()
+        s._queue.put(self._record('before'))
+        s._queue.put(self._record(Unprintable()))
+        s._queue.put(self._record('after'))
+        s._queue.put(None)
+
+        s._drain_queue()
+
+        assert len(s._loop.calls) == 1
+        payload = s._loop.calls[0][1][0]
+        assert isinstance(payload, bytes)
+        assert payload.startswith(b'[{') and payload.endswith(b'}]')
+        # The entry that failed to serialize is dropped, the rest of the batch survives
+        assert [e['args'] for e in json.loads(payload)] == [['before'], ['after']]
+
+    def test_drain_queue_caps_entries_per_frame(self):
+        s = SlogX()
+        s._loop = self.StubLoop()
+        for i in range(_BATCH_MAX_ENTRIES + 5):
+            s._queue.put(self._record(i))
+        s._queue.put(None)
+
+        # The first pass stops at the cap even though more records are already queued
+        worker = threading.Thread(target=s._drain_queue, daemon=True)
+        worker.start()
+        worker.join(timeout=2)
+
+        sizes = [len(json.loads(args[0])) for _, args in s._loop.calls]
+        assert sizes == [_BATCH_MAX_ENTRIES, 5]
+
+    def test_drain_queue_caps_bytes_per_frame(self):
+        s = SlogX()
+        s._loop = self.StubLoop()
+        big = 'x' * (_BATCH_MAX_BYTES // 3)
+        for _ in range(5):
+            s._queue.put(self._record(big))
+        s._queue.put(None)
+
+        s._drain_queue()
+
+        payloads = [args[0] for _, args in s._loop.calls]
+        assert len(payloads) > 1
+        assert all(len(p) <= _BATCH_MAX_BYTES + 1024 for p in payloads)
+        assert sum(len(json.loads(p)) for p in payloads) == 5
+
+    def test_drain_queue_one_call_per_batch(self):
+        s = SlogX()
+        s._loop = self.StubLoop()
+        worker = threading.Thread(target=s._drain_queue, daemon=True)
+        worker.start()
+
+        s._queue.put(self._record('batch 1'))
+        deadline = time.monotonic() + 2
+        while not s._loop.calls and time.monotonic() < deadline:
+            time.sleep(0.005)
+        s._queue.put(self._record('batch 2'))
+        s._queue.put(None)
+        worker.join(timeout=2)
+
+        assert not worker.is_alive()
+        assert len(s._loop.calls) == 2
+
+
 class TestLogEntryStructure:
     """Tests for log entry structure."""
 
     def test_log_entry_has_required_fields(self):
         s = SlogX()
-        caller = s._get_caller_info()
-
-        entry = {
-            'id': s._generate_id(),
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
-            'level': LogLevel.INFO.value,
-            'args': ['test message'],
-            'stacktrace': caller.get('clean_stack'),
-            'metadata': {
-                'file': caller.get('file'),
-                'line': caller.get('line'),
-                'func': caller.get('func'),
-                'lang': 'python',
-                'service': s._service_name
-            }
-        }
+        entry = s._build_entry('INFO', s._capture_stack(), *s._prepare_args(('test message',)), 0)
 
         assert 'id' in entry
         assert 'timestamp' in entry
@@ -174,30 +403,60 @@ class TestLogEntryStructure:
 
     def test_log_entry_json_serializable(self):
         s = SlogX()
-        caller = s._get_caller_info()
-
-        entry = {
-            'id': s._generate_id(),
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
-            'level': LogLevel.INFO.value,
-            'args': ['test', {'key': 'value'}, 42, True, None],
-            'stacktrace': caller.get('clean_stack'),
-            'metadata': {
-                'file': caller.get('file'),
-                'line': caller.get('line'),
-                'func': caller.get('func'),
-                'lang': 'python',
-                'service': s._service_name
-            }
-        }
+        entry = s._build_entry(
+            'INFO', s._capture_stack(), *s._prepare_args(('test', {'key': 'value'}, 42, True, None)), 0
+        )
 
         # Should not raise
-        json_str = json.dumps(entry)
+        json_str = _dumps(entry).decode()
         assert isinstance(json_str, str)
 
         # Should be valid JSON
         parsed = json.loads(json_str)
         assert parsed['level'] == 'INFO'
+        assert parsed['args'] == ['test', {'key': 'value'}, 42, True, None]
+
+    def test_build_entry_from_snapshot(self):
+        s = SlogX()
+        frames = [('/app/handlers.py', 42, 'handle'), ('/app/main.py', 7, 'main')]
+        entry = s._build_entry('WARN', frames, *s._prepare_args(('slow', {'ms': 450})), 1_700_000_000_123_456_789)
+
+        assert entry['level'] == 'WARN'
+        assert entry['args'] == ['slow', {'ms': 450}]
+        assert entry['timestamp'].isoformat() == '2023-11-14T22:13:20.123456+00:00'
+        assert entry['metadata']['file'] == 'handlers.py'
+        assert entry['metadata']['line'] == 42
+        assert entry['metadata']['func'] == 'handle'
+        assert entry['stacktrace'] == '  at handle (/app/handlers.py:42)\n  at main (/app/main.py:7)'
+
+    def test_build_entry_field_order(self):
+        s = SlogX()
+        entry = s._build_entry('INFO', [('/app/main.py', 1, 'main')], *s._prepare_args(('hi',)), 0)
+        encoded = _dumps(entry).decode()
+
+        assert list(json.loads(encoded)) == ['id', 'timestamp', 'level', 'args', 'stacktrace', 'metadata']
+        assert list(entry['metadata']) == ['file', 'line', 'func', 'lang', 'service']
+        assert '"timestamp":"1970-01-01T00:00:00Z"' in encoded
+
+    def test_build_entry_with_exception(self):
+        s = SlogX()
+        try:
+            raise ValueError('Test error')
+        except ValueError as e:
+            entry = s._build_entry('ERROR', s._capture_stack(), *s._prepare_args(('failed', e)), 0)
+
+        assert entry['args'][1]['name'] == 'ValueError'
+        assert entry['args'][1]['message'] == 'Test error'
+        assert 'ValueError: Test error' in entry['stacktrace']
+        assert entry['metadata']['func'] == 'test_build_entry_with_exception'
+
+    def test_build_entry_with_exception_skips_call_stack(self):
+        s = SlogX()
+        error = RuntimeError('boom')
+        with patch('slogx._format_stack') as format_stack:
+            entry = s._build_entry('ERROR', [('/app/main.py', 1, 'main')], *s._prepare_args((error,)), 0)
+        format_stack.assert_not_called()
+        assert 'RuntimeError: boom' in entry['stacktrace']
 
 
 class TestTimestamp:
@@ -287,6 +546,115 @@ class TestCIMode:
 
         s.close()
 
+    def test_ci_mode_entry_serialization(self):
+        s = SlogX()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, 'serialize.ndjson')
+            s.init(is_dev=True, ci_mode=True, log_file_path=log_path)
+
+            s.info('unicode 你好', {1: 'int key'}, object())
+            s._ci_writer.flush()
+
+            with open(log_path, 'r', encoding='utf-8') as f:
+                entry = json.loads(f.readline())
+
+            assert entry['timestamp'].endswith('Z')
+            assert 'T' in entry['timestamp']
+            assert entry['args'][0] == 'unicode 你好'
+            assert entry['args'][1] == {'1': 'int key'}
+            assert entry['args'][2].startswith('<object object')
+
+        s.close()
+
+    def test_ci_mode_big_int_entry_is_written(self):
+        s = SlogX()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, 'big.ndjson')
+            s.init(is_dev=True, ci_mode=True, log_file_path=log_path)
+
+            s.info('user id', 2**64)
+            s.info('ok')
+            s._ci_writer.flush()
+
+            with open(log_path, 'r', encoding='utf-8') as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+
+            assert len(entries) == 2
+            assert entries[0]['args'] == ['user id', 2**64]
+            assert entries[0]['timestamp'].endswith('Z')
+            assert entries[1]['args'] == ['ok']
+
+        s.close()
+
+    def test_min_level_filters_entries(self):
+        s = SlogX()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, 'levels.ndjson')
+            s.init(is_dev=True, ci_mode=True, log_file_path=log_path, min_level='WARN')
+
+            with patch.object(s, '_log', wraps=s._log) as log:
+                s.debug('dropped')
+                s.info('dropped')
+                s.warn('kept')
+                s.error('kept')
+            assert log.call_count == 2
+
+            s._ci_writer.flush()
+            with open(log_path, 'r') as f:
+                levels = [json.loads(line)['level'] for line in f if line.strip()]
+            assert levels == ['WARN', 'ERROR']
+
+        s.close()
+
+    def test_call_site_stack_is_opt_in(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stacks = []
+            for always_capture_stack in (False, True):
+                s = SlogX()
+                log_path = os.path.join(tmp_dir, f'{always_capture_stack}.ndjson')
+                s.init(
+                    is_dev=True,
+                    ci_mode=True,
+                    log_file_path=log_path,
+                    always_capture_stack=always_capture_stack
+                )
+                s.info('plain')
+                try:
+                    raise ValueError('boom')
+                except ValueError as e:
+                    s.error('failed', e)
+                s._ci_writer.flush()
+
+                with open(log_path, 'r') as f:
+                    entries = [json.loads(line) for line in f if line.strip()]
+                stacks.append([entry['stacktrace'] for entry in entries])
+                assert entries[0]['metadata']['func'] == 'test_call_site_stack_is_opt_in'
+                s.close()
+
+        assert stacks[0][0] is None
+        assert 'test_call_site_stack_is_opt_in' in stacks[1][0]
+        assert all('ValueError: boom' in run[1] for run in stacks)
+
+    def test_min_level_accepts_log_level_enum(self):
+        s = SlogX()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            s.init(
+                is_dev=True,
+                ci_mode=True,
+                log_file_path=os.path.join(tmp_dir, 'enum.ndjson'),
+                min_level=LogLevel.WARN
+            )
+            with patch.object(s, '_log') as log:
+                s.info('dropped')
+                s.warn('kept')
+            log.assert_called_once_with('WARN', 'kept')
+        s.close()
+
+    def test_min_level_rejects_unknown_level(self):
+        s = SlogX()
+        with pytest.raises(ValueError):
+            s.init(is_dev=True, ci_mode=True, min_level='TRACE')
+
     def test_init_ci_mode_auto_detect(self, monkeypatch):
         s = SlogX()
         with tempfile.TemporaryDirectory() as tmp_dir: